@@ -7,250 +7,587 @@ Dependencies:
 - FastAPI: Web framework for building APIs.
 - yt_dlp: For downloading audio from YouTube URLs.
 - Shazamio: For identifying songs using Shazam's API.
-- Spotipy: For interacting with the Spotify API.
-- BeautifulSoup: For scraping guitar tabs from Songsterr.
-- Google API Client: For interacting with the YouTube Data API.
+- Spotipy: For Spotify API authentication.
+- aiohttp: For asynchronous HTTP requests to Songsterr, the Spotify Web API and the YouTube Data API.
+- orjson: For fast JSON encoding and decoding, including API responses.
+- cachetools: For caching lookups per song and artist.
 - Uvicorn: ASGI server for running the FastAPI application.
+- ffmpeg: Required on PATH at runtime; yt-dlp uses it to cut the clip and shazamio uses it to decode AAC/Opus audio.
 Environment Variables:
 - SPOTIFY_CLIENT_ID: Spotify API client ID.
 - SPOTIFY_CLIENT_SECRET: Spotify API client secret.
 - YOUTUBE_API_KEY: YouTube Data API key.
+- CORS_ORIGINS: Optional. Comma-separated list of origins allowed to call the API from a browser.
+- TRUST_PROXY: Optional. Set to "true" behind a proxy that sets X-Forwarded-For, so rate limits apply per real client IP. The Procfile and railway.json start commands set it for Railway's edge proxy.
+- LOG_LEVEL: Optional. Logging level, INFO by default.
+- WEB_CONCURRENCY: Optional. Number of Uvicorn worker processes when run as `python main.py`, 2 by default.
+- SPOTIFY_STARTUP_TEST: Optional. When set, a fresh token is requested and a test search is run when the Spotify client is created.
 Routes:
 - GET /find-song: Identifies a song from a YouTube URL and retrieves related information.
 - POST /identify-audio: Identifies a song from an uploaded audio file and retrieves related information.
 - GET /youtube-lessons-videos: Retrieves YouTube video IDs for guitar lessons of a given song and artist.
+- POST /youtube-lessons-videos-bulk: Retrieves YouTube lesson video IDs for up to 50 songs in one request.
 - GET /test-spotify: Tests Spotify API integration by searching for a song and artist.
 Classes:
+- BodySizeLimitMiddleware: Rejects oversized request bodies on upload routes, by Content-Length or by counting streamed bytes.
+- RateLimitMiddleware: Per-IP token bucket rate limiting for the expensive routes.
 - SafeCacheHandler: Custom cache handler for managing Spotify API tokens.
 Functions:
+- get_spotify(): Returns the shared Spotify client, creating it on first use.
+- song_lookup_cache(ttl, negative_ttl, is_negative): Memoizes a lookup keyed on song name and artist name.
 - download_audio(yt_url): Downloads audio from a YouTube URL.
-- identify_song(audio_path): Identifies a song using Shazam from a given audio file path.
+- identify_song(audio): Identifies a song using Shazam from a given audio file path or raw audio bytes.
+- get_spotify_access_token(): Returns a valid Spotify access token, refreshing it if needed.
 - search_spotify(song_name, artist_name): Searches for a song on Spotify and retrieves metadata.
+- warm_spotify_token(): Refreshes the cached Spotify access token ahead of a search.
+- tab_href_pattern(sanitized_song_name): Returns a compiled regex for a song's Songsterr tab link.
 - search_tabs(song_name, artist_name): Searches for guitar tabs on Songsterr.
 - get_youtube_guitar_lessons_link(song_name, artist_name): Generates a YouTube search URL for guitar lessons.
+- youtube_api_get(resource, params): Calls a YouTube Data API endpoint and returns the decoded response.
 - get_youtube_video_ids(song_name, artist_name): Retrieves YouTube video IDs for guitar lessons using the YouTube Data API.
+- get_available_video_ids(video_ids): Returns the subset of YouTube video IDs that are still available.
+- get_youtube_video_ids_or_empty(song_name, artist_name): Same as get_youtube_video_ids, but returns an empty list on errors.
 Usage:
 Run the script with `uvicorn` to start the FastAPI server. Ensure all required environment variables are set.
 """
 import shutil
 from fastapi import FastAPI, HTTPException, UploadFile, File
 import yt_dlp
+from yt_dlp.utils import download_range_func
 import tempfile
 import os
-import json
+import re
+import orjson
 import asyncio
+import contextlib
+import glob
+import functools
+import logging
+import math
+import threading
 import time
+import uuid
+from typing import Dict, List
+from cachetools import TLRUCache, TTLCache
 from shazamio import Shazam
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
-import requests
-from bs4 import BeautifulSoup
-from googleapiclient.discovery import build
+import aiohttp
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from urllib.parse import quote_plus
 
-app = FastAPI()
+# Configure logging
+# INFO by default; set LOG_LEVEL=DEBUG to include raw API responses and recognition results.
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Application lifespan
+# One aiohttp session is opened on startup and stored on app.state, so every outbound HTTP request
+# reuses a keep-alive connection pool instead of paying a TLS handshake per call. It is closed on shutdown.
+# The Spotify client is also created here, off the event loop.
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    app.state.http = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=100, limit_per_host=50, ttl_dns_cache=300),
+        headers={"User-Agent": "Mozilla/5.0"},
+        timeout=aiohttp.ClientTimeout(total=10)
+    )
+    # Build the Spotify client in a worker thread before serving, so requests never wait on its lock.
+    # A failure is already logged and remembered by get_spotify, and is retried on a later request.
+    with contextlib.suppress(Exception):
+        await asyncio.to_thread(get_spotify)
+    try:
+        yield
+    finally:
+        await app.state.http.close()
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+
+# Rate limits per route: at most `limit` requests per client IP every `period` seconds.
+# These protect the Spotify, Shazam and YouTube quotas from a single client hammering the expensive routes.
+RATE_LIMITS = {
+    "/find-song": {"limit": 5, "period": 60},
+    "/identify-audio": {"limit": 5, "period": 60},
+    "/youtube-lessons-videos": {"limit": 30, "period": 60},
+    "/youtube-lessons-videos-bulk": {"limit": 1, "period": 60},
+}
+
+# Only trust the X-Forwarded-For header when running behind a proxy that sets it (e.g. Railway).
+TRUST_PROXY = os.getenv("TRUST_PROXY", "").lower() in ("1", "true", "yes")
+
+# Token bucket rate limiting middleware
+# Each (route, client IP) pair gets a bucket that refills at limit/period tokens per second.
+# Requests over the limit are rejected with a 429 before they reach any upstream API.
+# Buckets live in a TTL cache so clients that go quiet for a full period are forgotten.
+class RateLimitMiddleware:
+    def __init__(self, app, rules, max_clients=10000):
+        self.app = app
+        self.rules = rules
+        self.buckets = {
+            path: TTLCache(maxsize=max_clients, ttl=rule["period"])
+            for path, rule in rules.items()
+        }
+
+    async def __call__(self, scope, receive, send):
+        rule = self.rules.get(scope["path"]) if scope["type"] == "http" else None
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+        buckets = self.buckets[scope["path"]]
+        client_ip = self.client_ip(scope)
+        now = time.monotonic()
+        tokens, last_seen = buckets.get(client_ip, (rule["limit"], now))
+        tokens = min(rule["limit"], tokens + (now - last_seen) * rule["limit"] / rule["period"])
+        if tokens < 1:
+            retry_after = math.ceil((1 - tokens) * rule["period"] / rule["limit"])
+            logger.warning("Rate limit exceeded for %s on %s", client_ip, scope["path"])
+            response = ORJSONResponse(
+                {"detail": "Rate limit exceeded. Please try again later."},
+                status_code=429,
+                headers={"Retry-After": str(retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+        buckets[client_ip] = (tokens - 1, now)
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def client_ip(scope):
+        # X-Forwarded-For is set by the client unless a proxy overwrites it, so it is only trusted
+        # when TRUST_PROXY is set; then the last hop is the address our proxy saw.
+        # Otherwise use the socket peer, which uvicorn's --proxy-headers/--forwarded-allow-ips
+        # already rewrites for trusted proxies.
+        if TRUST_PROXY:
+            for name, value in scope.get("headers", []):
+                if name == b"x-forwarded-for":
+                    return value.decode("latin-1").split(",")[-1].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+# Request body limits per route, checked against Content-Length before FastAPI parses the form.
+# Starlette receives and spools the whole multipart body before the handler runs,
+# so this is the only point where an oversized upload can be refused without receiving it.
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024  # Shazam only needs a few seconds of audio
+BODY_SIZE_LIMITS = {
+    ("POST", "/identify-audio"): MAX_UPLOAD_BYTES + 64 * 1024,  # Leave room for the multipart framing
+}
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+# Request body size limiting middleware
+# Limits are keyed on (method, path). A declared Content-Length over the limit is rejected up front;
+# otherwise body bytes are counted as the app reads them, so chunked uploads are bounded too.
+# Once the count passes the limit the app's own response is dropped and a 413 is sent instead.
+class BodySizeLimitMiddleware:
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get((scope["method"], scope["path"])) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        for name, value in scope.get("headers", []):
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                await self.reject(scope, receive, send)
+                return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            # The app may turn the error from receive() into its own response; drop it in favour of the 413
+            if exceeded and not response_started:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            pass
+        if exceeded and not response_started:
+            await self.reject(scope, receive, send)
+
+    async def reject(self, scope, receive, send):
+        logger.warning("Rejected oversized request body on %s", scope["path"])
+        response = ORJSONResponse({"detail": "Audio file too large."}, status_code=413)
+        await response(scope, receive, send)
+
+# Add the body size check first so it runs inside rate limiting, and rate limiting before CORS
+# so that CORS wraps both and their 4xx responses still carry CORS headers.
+app.add_middleware(BodySizeLimitMiddleware, limits=BODY_SIZE_LIMITS)
+app.add_middleware(RateLimitMiddleware, rules=RATE_LIMITS)
 
 # Add CORS Middleware for handling CORS issues
 # This is important for allowing requests from different origins, especially in a web app context.
-# Adjust the allowed origins as per your deployment needs.
-# For example, you might want to restrict it to your frontend app's URL in production.
+# Allowed origins come from the comma-separated CORS_ORIGINS environment variable,
+# e.g. your frontend app's URL in production. A wildcard is not valid together with credentials.
+CORS_ORIGINS = [origin.strip() for origin in os.getenv("CORS_ORIGINS", "").split(",") if origin.strip()]
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type", "Authorization"],
 )
 
-
-
 # Load environment variables
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
+YOUTUBE_API_URL = "https://www.googleapis.com/youtube/v3"
 
 
 # Custom cache handler with full implementation
 # This is a more robust implementation of the cache handler for Spotipy.
 # It handles token caching and retrieval, ensuring that the token is valid and can be refreshed if needed.
+# The token is held in memory only, together with its expiry, so no request ever touches disk for it.
+# It is stored on the class so every handler instance in the process shares one token.
 class SafeCacheHandler(spotipy.cache_handler.CacheHandler):
-    def __init__(self):
-        self.cache_path = ".cache"
+    _token_info = None
+    _expires_at = 0
 
     def get_cached_token(self):
-        try:
-            if not os.path.exists(self.cache_path):
-                print("No cache file found, will request new token.")
-                return None
-            with open(self.cache_path, 'r') as f:
-                token_info_string = f.read().strip()
-                if not token_info_string:
-                    print("Cache file is empty, will request new token.")
-                    return None
-                return json.loads(token_info_string)
-        except (json.JSONDecodeError, FileNotFoundError) as e:
-            print(f"Cache read error: {str(e)}, will request new token.")
-            return None
+        # Treat the token as expired a minute early so it is never used right at its expiry.
+        if SafeCacheHandler._token_info and time.time() < SafeCacheHandler._expires_at - 60:
+            return SafeCacheHandler._token_info
+        return None
 
     def save_token_to_cache(self, token_info):
-        try:
-            with open(self.cache_path, 'w') as f:
-                json.dump(token_info, f)
-            print("Token saved to cache.")
-        except Exception as e:
-            print(f"Failed to save token to cache: {str(e)}")
+        SafeCacheHandler._token_info = token_info
+        SafeCacheHandler._expires_at = token_info.get("expires_at", time.time() + token_info.get("expires_in", 0))
+        logger.debug("Token saved to cache.")
 
-# Initialize Spotify client with fallback
+# Initialize Spotify client lazily with fallback
 # This is a more robust implementation of the Spotify client initialization.
+# The client is created on first use rather than at import time, which keeps cold starts fast.
 # It handles exceptions and provides a fallback mechanism in case the initial token request fails.
-try:
-    auth_manager = SpotifyClientCredentials(
-        client_id=SPOTIFY_CLIENT_ID,
-        client_secret=SPOTIFY_CLIENT_SECRET,
-        cache_handler=SafeCacheHandler()
-    )
-    sp = spotipy.Spotify(auth_manager=auth_manager)
+# Set SPOTIFY_STARTUP_TEST to force a fresh token and run a test search when the client is created.
+# A failed initialization is remembered for SPOTIFY_INIT_RETRY_SECONDS so requests do not rebuild it every time.
+SPOTIFY_INIT_RETRY_SECONDS = 60
+_spotify_client = None
+_spotify_init_error = None
+_spotify_init_failed_at = 0
+_spotify_lock = threading.Lock()
+
+def run_spotify_startup_test(client, label):
     # Force a fresh token and test
     # This is important to ensure that the token is valid and can be used for API requests.
     # It also helps in debugging issues related to token expiration or invalidation.
-    token = auth_manager.get_access_token(as_dict=False, check_cache=False)
-    print(f"Spotify access token: {token}")
-    test_result = sp.search(q="track:bohemian rhapsody artist:queen", type='track', limit=1)
-    print(f"Spotify startup test successful: {json.dumps(test_result, indent=2)}")
-except Exception as e:
-    print(f"Failed to initialize Spotify client: {str(e)}")
-    # Fallback: Try without cache
-    # This is a fallback mechanism to handle cases where the cache handler fails or is not available.
-    # It ensures that the application can still function without caching, albeit with a performance hit.
+    client.auth_manager.get_access_token(as_dict=False, check_cache=False)
+    logger.info("%s access token obtained.", label)
+    test_result = client.search(q="track:bohemian rhapsody artist:queen", type='track', limit=1)
+    logger.info("%s startup test successful: %s", label, orjson.dumps(test_result).decode())
+
+def create_spotify_client():
+    try:
+        auth_manager = SpotifyClientCredentials(
+            client_id=SPOTIFY_CLIENT_ID,
+            client_secret=SPOTIFY_CLIENT_SECRET,
+            cache_handler=SafeCacheHandler()
+        )
+        client = spotipy.Spotify(auth_manager=auth_manager)
+        if os.getenv("SPOTIFY_STARTUP_TEST"):
+            run_spotify_startup_test(client, "Spotify")
+        return client
+    except Exception as e:
+        logger.error("Failed to initialize Spotify client: %s", e)
+    # Fallback: Try with Spotipy's own cache handler
+    # This is a fallback mechanism to handle cases where the custom cache handler fails or is not available.
+    # It ensures that the application can still function if the custom handler cannot be used.
     try:
         auth_manager = SpotifyClientCredentials(
             client_id=SPOTIFY_CLIENT_ID,
             client_secret=SPOTIFY_CLIENT_SECRET,
-            cache_handler=None  # Disable caching entirely
+            cache_handler=spotipy.cache_handler.MemoryCacheHandler()  # Spotipy's plain in-memory cache
         )
-        sp = spotipy.Spotify(auth_manager=auth_manager)
-        token = auth_manager.get_access_token(as_dict=False)
-        print(f"Fallback Spotify access token: {token}")
-        test_result = sp.search(q="track:bohemian rhapsody artist:queen", type='track', limit=1)
-        print(f"Fallback Spotify startup test successful: {json.dumps(test_result, indent=2)}")
+        client = spotipy.Spotify(auth_manager=auth_manager)
+        if os.getenv("SPOTIFY_STARTUP_TEST"):
+            run_spotify_startup_test(client, "Fallback Spotify")
+        return client
     except Exception as e:
-        print(f"Fallback initialization also failed: {str(e)}")
+        logger.error("Fallback initialization also failed: %s", e)
         raise
 
+# This function returns the shared Spotify client, creating it on first use.
+# The lock ensures concurrent first requests only initialize it once. It blocks (and may do network IO
+# when SPOTIFY_STARTUP_TEST is set), so call it from a worker thread, never directly on the event loop.
+def get_spotify():
+    global _spotify_client, _spotify_init_error, _spotify_init_failed_at
+    if _spotify_client is None:
+        with _spotify_lock:
+            if _spotify_client is None:
+                if _spotify_init_error and time.time() - _spotify_init_failed_at < SPOTIFY_INIT_RETRY_SECONDS:
+                    raise _spotify_init_error
+                try:
+                    _spotify_client = create_spotify_client()
+                    _spotify_init_error = None
+                except Exception as e:
+                    _spotify_init_error = e
+                    _spotify_init_failed_at = time.time()
+                    raise
+    return _spotify_client
 
-# Initialize YouTube API client
-# This is a more robust implementation of the YouTube API client initialization.
-# It handles exceptions and provides a fallback mechanism in case the initial token request fails.
-youtube = build('youtube', 'v3', developerKey=YOUTUBE_API_KEY)
 
+# This decorator memoizes a lookup that takes a song name and artist name.
+# Results are keyed case-insensitively and kept for `ttl` seconds, while negative results
+# (as decided by `is_negative`) expire after `negative_ttl` seconds so misses are retried sooner.
+def song_lookup_cache(ttl, negative_ttl=300, is_negative=lambda result: not result, maxsize=4096):
+    def decorator(func):
+        cache = TLRUCache(
+            maxsize=maxsize,
+            ttu=lambda _key, result, now: now + (negative_ttl if is_negative(result) else ttl)
+        )
+
+        def song_key(song_name, artist_name):
+            return (song_name.lower(), artist_name.lower())
+
+        @functools.wraps(func)
+        async def wrapper(song_name, artist_name):
+            key = song_key(song_name, artist_name)
+            try:
+                return cache[key]
+            except KeyError:
+                pass
+            result = await func(song_name, artist_name)
+            cache[key] = result
+            return result
+        wrapper.cache = cache
+        wrapper.cache_key = song_key
+        return wrapper
+    return decorator
+
+# Initialize a single Shazam client
+# It is reused across requests so the library setup is paid once and its HTTP state can be shared.
+shazam = Shazam()
+
+# Directory for downloaded clips: tmpfs when available, otherwise the system temp directory.
+AUDIO_DOWNLOAD_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+# This function downloads the first seconds of a YouTube video's audio for Shazam.
+# The file is named after the stream's real extension (usually .m4a or .webm), and its path is returned.
 def download_audio(yt_url):
-    if os.path.exists("/dev/shm"):
-        audio_path = "/dev/shm/audio.m4a" if "iOS" in yt_url else "/dev/shm/audio.mp3"
-    else:
-        audio_path = tempfile.mktemp(suffix='.m4a' if "iOS" in yt_url else '.mp3')
+    # A unique prefix per download so concurrent requests never share a path.
+    path_prefix = os.path.join(AUDIO_DOWNLOAD_DIR, f"tabify-{uuid.uuid4().hex}")
     ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': audio_path,
+        # The smallest audio stream is enough for fingerprinting, preferring AAC.
+        # shazamio_core only decodes MP3 and WAV natively, so shazamio converts this stream
+        # through an ffmpeg subprocess; ffmpeg must be on PATH (see nixpacks.toml).
+        'format': 'worstaudio[acodec^=mp4a]/worstaudio/worst',
+        'outtmpl': f"{path_prefix}.%(ext)s",
         'quiet': True,
         'noplaylist': True,
-        'postprocessor_args': ['-t', '8', '-b:a', '48k'],
+        # Only fetch the first 12 seconds; Shazam needs a short clip, not the whole stream.
+        'download_ranges': download_range_func(None, [(0, 12)]),
+        'force_keyframes_at_cuts': False,
     }
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        ydl.download([yt_url])
-    return audio_path
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(yt_url, download=True)
+            return info['requested_downloads'][0]['filepath']
+    except Exception:
+        # Remove anything left behind by a failed download, including .part files.
+        for leftover in glob.glob(f"{path_prefix}.*"):
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(leftover)
+        raise
 
 # This function identifies a song using Shazam's API.
-# It takes the path to the audio file as input and returns the recognition result.
-async def identify_song(audio_path):
-    shazam = Shazam()
+# It takes the path to the audio file, or raw audio bytes already in memory, and returns the recognition result.
+# A path is handed straight to shazamio, which reads the file (converting non-MP3/WAV audio with ffmpeg)
+# itself, so downloaded audio is never buffered on the Python side.
+async def identify_song(audio):
     try:
-        with open(audio_path, 'rb') as f:
-            audio = f.read()  # Read the entire file into memory
         result = await shazam.recognize(audio)
-        print(f"Shazam recognition result: {result}")
+        logger.debug("Shazam recognition result: %s", result)
         return result
     except Exception as e:
-        print(f"Shazam failed: {str(e)}")
+        logger.warning("Shazam failed: %s", e)
         return {"error": f"Shazam failed: {str(e)}"}
     
+# This function returns a valid Spotify access token for direct Web API calls.
+# A cached token is returned without leaving the event loop; only a refresh goes through Spotipy in a worker thread.
+async def get_spotify_access_token():
+    # Once the client exists it is read without the lock; otherwise build it off the event loop.
+    client = _spotify_client or await asyncio.to_thread(get_spotify)
+    auth_manager = client.auth_manager
+    token_info = auth_manager.cache_handler.get_cached_token()
+    if token_info and not auth_manager.is_token_expired(token_info):
+        return token_info['access_token']
+    return await asyncio.to_thread(auth_manager.get_access_token, as_dict=False)
+
 # This function searches for a song on Spotify using the provided song name and artist name.
+# It calls the Spotify Web API directly over the shared aiohttp session instead of blocking a thread in Spotipy.
 # It returns the song name, artist name, and album art URL if found.
 # If no results are found, it returns an error message.
-def search_spotify(song_name, artist_name):
+# Results are cached for an hour; errors are cached for five minutes.
+@song_lookup_cache(ttl=3600, is_negative=lambda result: "error" in result)
+async def search_spotify(song_name, artist_name):
     query = f"track:{song_name} artist:{artist_name}"
     try:
-        results = sp.search(q=query, type='track', limit=1)
-        print(f"Spotify raw response for '{query}': {json.dumps(results, indent=2)}")
+        token = await get_spotify_access_token()
+        async with app.state.http.get(
+            "https://api.spotify.com/v1/search",
+            params={"q": query, "type": "track", "limit": "1"},
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=aiohttp.ClientTimeout(total=5)
+        ) as response:
+            body = await response.read()
+        if response.status != 200:
+            logger.warning("Spotify API error: %s - HTTP status: %s", body.decode(errors='replace'), response.status)
+            return {"error": f"Spotify API error: HTTP status {response.status}"}
+        results = orjson.loads(body)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Spotify raw response for '%s': %s", query, body.decode(errors='replace'))
         if not results or not results.get('tracks') or not results['tracks'].get('items'):
-            print(f"No Spotify results for {song_name} by {artist_name}")
+            logger.info("No Spotify results for %s by %s", song_name, artist_name)
             return {"error": "No results found on Spotify"}
         track = results['tracks']['items'][0]
         album_art = track['album']['images'][0]['url'] if track['album']['images'] else None
         if not album_art:
-            print(f"No album art available for {song_name} by {artist_name}")
+            logger.debug("No album art available for %s by %s", song_name, artist_name)
         return {
             "song": track['name'],
             "artist": ', '.join(artist['name'] for artist in track['artists']),
             "album_art": album_art
         }
-    except spotipy.exceptions.SpotifyException as se:
-        print(f"Spotify API error: {str(se)} - HTTP status: {se.http_status if hasattr(se, 'http_status') else 'unknown'}")
-        return {"error": f"Spotify API error: {str(e)}"}
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning("Spotify request error: %s", e)
+        return {"error": f"Spotify request error: {str(e)}"}
     except ValueError as ve:
-        print(f"JSON parsing error in Spotify search: {str(ve)}")
+        logger.warning("JSON parsing error in Spotify search: %s", ve)
         return {"error": f"JSON parsing error: {str(ve)}"}
     except Exception as e:
-        print(f"Unexpected error in Spotify search: {str(e)}")
+        logger.error("Unexpected error in Spotify search: %s", e)
         return {"error": f"Unexpected error: {str(e)}"}
 
-def search_tabs(song_name, artist_name):
+# This function makes sure a valid Spotify access token is cached before a search needs it.
+# It is run alongside slow IO such as the audio download, so failures are only logged;
+# search_spotify will report any real authentication problem.
+def warm_spotify_token():
+    try:
+        get_spotify().auth_manager.get_access_token(as_dict=False)
+    except Exception as e:
+        logger.warning("Spotify token warm-up failed: %s", e)
+
+# Characters stripped from song names when matching Songsterr tab URLs
+_SANITIZE_RE = re.compile(r"[^\w\s-]")
+
+# This function returns a compiled pattern that finds a Songsterr tab link for a sanitized song name.
+# It matches the raw response bytes directly, so the page is never decoded or parsed as HTML.
+@functools.lru_cache(maxsize=1024)
+def tab_href_pattern(sanitized_song_name):
+    return re.compile(rb'<a\s[^>]*?href="([^"]*-' + re.escape(sanitized_song_name.encode()) + rb'-tab[^"]*)"')
+
+# This function searches Songsterr for a guitar tab matching the song name and artist name.
+# It returns a direct tab URL when one is found, otherwise the Songsterr search URL.
+# Direct tab URLs are cached for an hour; search URL fallbacks are cached for five minutes.
+@song_lookup_cache(ttl=3600, is_negative=lambda result: "/?pattern=" in result)
+async def search_tabs(song_name, artist_name):
     # Sanitize song name by removing special characters and replacing spaces with hyphens
     # This is important to ensure that the URL is valid and does not contain any illegal characters.
     # It also helps in avoiding issues with URL encoding and decoding.
-    import re
-    sanitized_song_name = re.sub(r"[^\w\s-]", "", song_name).replace(" ", "-").lower()
-    search_url = f"https://www.songsterr.com/?pattern={song_name.replace(' ', '+')}+{artist_name.replace(' ', '+')}"
-    headers = {"User-Agent": "Mozilla/5.0"}
+    sanitized_song_name = _SANITIZE_RE.sub("", song_name).replace(" ", "-").lower()
+    search_url = f"https://www.songsterr.com/?pattern={quote_plus(f'{song_name} {artist_name}')}"
     try:
-        response = requests.get(search_url, headers=headers, timeout=5)
-        print(f"Songsterr search response status: {response.status_code}")
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, "html.parser")
-            # Use sanitized song name in the selector
-            # This is important to ensure that the selector matches the correct element in the HTML.
-            # It also helps in avoiding issues with incorrect or unexpected HTML structure.
-            result_link = soup.select_one(f"a[href*='-{sanitized_song_name}-tab']")
-            if result_link:
-                return f"https://www.songsterr.com{result_link['href']}"
-        print("No direct tab found, returning search URL.")
-    except requests.RequestException as e:
-        print(f"Error fetching tabs: {str(e)}")
+        async with app.state.http.get(search_url, timeout=aiohttp.ClientTimeout(total=5)) as response:
+            logger.debug("Songsterr search response status: %s", response.status)
+            if response.status == 200:
+                # Use sanitized song name in the pattern
+                # This is important to ensure that the pattern matches the correct link in the HTML.
+                # It also helps in avoiding issues with incorrect or unexpected HTML structure.
+                result_link = tab_href_pattern(sanitized_song_name).search(await response.read())
+                if result_link:
+                    return f"https://www.songsterr.com{result_link.group(1).decode()}"
+        logger.debug("No direct tab found, returning search URL.")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning("Error fetching tabs: %s", e)
     except Exception as e:
-        print(f"Error parsing Songsterr page: {str(e)}")
+        logger.warning("Error parsing Songsterr page: %s", e)
     return search_url
 
 # This function generates a YouTube search URL for guitar lessons based on the song name and artist name.
-# It replaces spaces with '+' for the search query and encodes the URL properly.
+# It encodes the search query with quote_plus. This is pure string formatting, so callers invoke it directly.
 def get_youtube_guitar_lessons_link(song_name, artist_name):
     search_query = f"{song_name} {artist_name} guitar lesson"
-    return f"https://www.youtube.com/results?tenersearch_query={search_query.replace(' ', '+')}&sp=EgIYAw%253D%253D"
+    return f"https://www.youtube.com/results?search_query={quote_plus(search_query)}&sp=EgIYAw%253D%253D"
+
+# This function calls a YouTube Data API v3 endpoint over the shared aiohttp session.
+# It returns the decoded JSON response and raises on HTTP errors, without exposing the API key in the message.
+async def youtube_api_get(resource, params):
+    async with app.state.http.get(
+        f"{YOUTUBE_API_URL}/{resource}",
+        params={**params, "key": YOUTUBE_API_KEY}
+    ) as response:
+        body = await response.read()
+    if response.status != 200:
+        logger.warning("YouTube API error: %s - HTTP status: %s", body.decode(errors='replace'), response.status)
+        raise RuntimeError(f"YouTube API error: HTTP status {response.status}")
+    return orjson.loads(body)
 
 # This function retrieves YouTube video IDs for guitar lessons using the YouTube Data API.
 # It searches for videos based on the song name and artist name, and returns a list of video IDs.
-def get_youtube_video_ids(song_name, artist_name):
+# Results are cached for a day since the YouTube quota is the scarce resource; empty results for five minutes.
+@song_lookup_cache(ttl=86400)
+async def get_youtube_video_ids(song_name, artist_name):
     search_query = f"{song_name} {artist_name} guitar lesson"
-    request = youtube.search().list(
-        part="id",
-        q=search_query,
-        type="video",
-        maxResults=3,
-        videoEmbeddable="true",
-        order="relevance"
-    )
-    response = request.execute()
+    response = await youtube_api_get("search", {
+        "part": "id",
+        "q": search_query,
+        "type": "video",
+        "maxResults": "3",
+        "videoEmbeddable": "true",
+        "order": "relevance",
+        "fields": "items/id/videoId"
+    })
     video_ids = [item['id']['videoId'] for item in response.get('items', [])]
     return video_ids
 
+# This function checks which of the given YouTube video IDs are still available.
+# A videos.list call costs 1 quota unit for up to 50 IDs, compared to 100 units for a search.
+async def get_available_video_ids(video_ids):
+    unique_ids = list(dict.fromkeys(video_ids))
+    responses = await asyncio.gather(*(
+        youtube_api_get("videos", {
+            "part": "id",
+            "id": ",".join(unique_ids[start:start + 50]),
+            "fields": "items/id"
+        })
+        for start in range(0, len(unique_ids), 50)  # videos.list accepts at most 50 IDs per call
+    ))
+    return {item['id'] for response in responses for item in response.get('items', [])}
+
+# This function wraps get_youtube_video_ids for the song identification endpoints.
+# A YouTube failure should not fail the whole identification, so errors are logged and an empty list is returned.
+async def get_youtube_video_ids_or_empty(song_name, artist_name):
+    try:
+        return await get_youtube_video_ids(song_name, artist_name)
+    except Exception as e:
+        logger.warning("Error fetching YouTube videos: %s", e)
+        return []
+
 # This function handles the /find-song endpoint.
 # It takes a YouTube URL as input, downloads the audio, identifies the song using Shazam,
 @app.get("/find-song")
@@ -258,63 +595,66 @@ async def find_song(yt_url: str):
     if not yt_url:
         raise HTTPException(status_code=400, detail="YouTube URL is required.")
     start_time = time.time()
-    audio_path = download_audio(yt_url)
+    # Refresh the Spotify token while the audio downloads so the lookups below do not wait on it.
+    token_task = asyncio.create_task(asyncio.to_thread(warm_spotify_token))
+    audio_path = await asyncio.to_thread(download_audio, yt_url)
     try:
         song_info = await identify_song(audio_path)
         if not song_info or 'track' not in song_info:
             raise HTTPException(status_code=404, detail="Could not identify the song.")
         song_name = song_info['track']['title']
         artist_name = song_info['track']['subtitle']
-        spotify_result, tab_url, youtube_lessons_url = await asyncio.gather(
-            asyncio.to_thread(search_spotify, song_name, artist_name),
-            asyncio.to_thread(search_tabs, song_name, artist_name),
-            asyncio.to_thread(get_youtube_guitar_lessons_link, song_name, artist_name)
+        await token_task
+        youtube_lessons_url = get_youtube_guitar_lessons_link(song_name, artist_name)
+        spotify_result, tab_url, youtube_video_ids = await asyncio.gather(
+            search_spotify(song_name, artist_name),
+            search_tabs(song_name, artist_name),
+            get_youtube_video_ids_or_empty(song_name, artist_name)
         )
         execution_time = time.time() - start_time
-        print(f"Execution time: {execution_time:.2f} seconds")
+        logger.info("Execution time: %.2f seconds", execution_time)
         return {
             "song": song_name,
             "artist": artist_name,
             "spotify": spotify_result,
             "tabs": tab_url,
             "youtube_lessons": youtube_lessons_url,
+            "youtube_video_ids": youtube_video_ids,
             "execution_time": f"{execution_time:.2f} seconds"
         }
     finally:
-        if os.path.exists(audio_path):
-            os.remove(audio_path)
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(audio_path)
+
+# Uploads are copied into memory in 64 KiB chunks; the copy is capped at MAX_UPLOAD_BYTES.
+UPLOAD_CHUNK_SIZE = 1 << 16
 
 # This function handles the /identify-audio endpoint.
 # It takes an uploaded audio file, identifies the song using Shazam,
 @app.post("/identify-audio")
 async def identify_audio(file: UploadFile = File(...)):
     start_time = time.time()
-    audio_path = tempfile.mktemp(suffix='.m4a' if "iOS" in file.filename else '.mp3')
     try:
-        # Save uploaded file to a temporary location 
-        # This is important to ensure that the file is accessible for processing.
-        # It also helps in avoiding issues with file permissions and access rights.
-        with open(audio_path, 'wb') as f:
-            content = await file.read()
-            if not content:
-                raise HTTPException(status_code=400, detail="Empty audio file uploaded.")
-            f.write(content)
-
+        # Keep the uploaded audio in memory
+        # Shazam accepts raw bytes, so the upload never needs to be written to disk and read back.
+        # BodySizeLimitMiddleware already bounds the request; the cap here bounds the in-memory copy of the file.
+        content = bytearray()
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            content.extend(chunk)
+            if len(content) > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail="Audio file too large.")
+        if not content:
+            raise HTTPException(status_code=400, detail="Empty audio file uploaded.")
 
         # Verify file is a valid audio file 
-        try:
-            with open(audio_path, 'rb') as f:
-                audio = f.read()
-                if len(audio) < 1024:  # Basic size check
-                    raise HTTPException(status_code=400, detail="Audio file too small.")
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Invalid audio file: {str(e)}")
+        if len(content) < 1024:  # Basic size check
+            raise HTTPException(status_code=400, detail="Audio file too small.")
 
         # Recognize song using Shazam
         # This is important to ensure that the audio file is processed correctly.
-        song_info = await identify_song(audio_path)
+        song_info = await identify_song(content)
         if not song_info or 'track' not in song_info:
-            print(f"Shazam returned no track info: {song_info}")
+            logger.info("Shazam returned no track info: %s", song_info)
             return {
                 "error": "Could not identify the song. Please try a longer or clearer audio sample."
             }
@@ -322,16 +662,17 @@ async def identify_audio(file: UploadFile = File(...)):
         song_name = song_info['track']['title']
         artist_name = song_info['track']['subtitle']
 
-        # Gather additional data from Spotify, Songsterr, and YouTube
+        # Gather additional data from Spotify, Songsterr, and YouTube (including embeddable lesson video IDs)
         # This is important to ensure that all data is fetched concurrently, improving performance.
-        spotify_result, tab_url, youtube_lessons_url = await asyncio.gather(
-            asyncio.to_thread(search_spotify, song_name, artist_name),
-            asyncio.to_thread(search_tabs, song_name, artist_name),
-            asyncio.to_thread(get_youtube_guitar_lessons_link, song_name, artist_name)
+        youtube_lessons_url = get_youtube_guitar_lessons_link(song_name, artist_name)
+        spotify_result, tab_url, youtube_video_ids = await asyncio.gather(
+            search_spotify(song_name, artist_name),
+            search_tabs(song_name, artist_name),
+            get_youtube_video_ids_or_empty(song_name, artist_name)
         )
 
         execution_time = time.time() - start_time
-        print(f"Audio identification time: {execution_time:.2f} seconds")
+        logger.info("Audio identification time: %.2f seconds", execution_time)
 
         # Return the results
         return {
@@ -340,14 +681,14 @@ async def identify_audio(file: UploadFile = File(...)):
             "spotify": spotify_result,
             "tabs": tab_url,
             "youtube_lessons": youtube_lessons_url,
+            "youtube_video_ids": youtube_video_ids,
             "execution_time": f"{execution_time:.2f} seconds"
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in identify_audio: {str(e)}")
+        logger.error("Error in identify_audio: %s", e)
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
-    finally:
-        if os.path.exists(audio_path):
-            os.remove(audio_path)
 
 # This function handles the /youtube-lessons-videos endpoint.
 # It takes a song name and artist name as input, retrieves YouTube video IDs for guitar lessons,
@@ -357,24 +698,109 @@ async def youtube_lessons_videos(song_name: str, artist_name: str):
     if not song_name or not artist_name:
         raise HTTPException(status_code=400, detail="Song name and artist name are required.")
     try:
-        video_ids = get_youtube_video_ids(song_name, artist_name)
+        video_ids = await get_youtube_video_ids(song_name, artist_name)
         if not video_ids:
             raise HTTPException(status_code=404, detail="No videos found.")
         return {"video_ids": video_ids}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching YouTube videos: {str(e)}")
 
+# Maximum number of songs accepted by /youtube-lessons-videos-bulk in one request
+MAX_BULK_SONGS = 50
+# Maximum number of uncached songs searched per bulk request. Each search costs 100 of the
+# 10,000 daily YouTube quota units, so this caps a single request at 500 units.
+MAX_BULK_SEARCHES = 5
+
+# This function handles the /youtube-lessons-videos-bulk endpoint.
+# It takes a list of {"song_name", "artist_name"} objects and returns the lesson video IDs for each.
+# Songs are deduplicated and served from the lookup cache where possible, so only cache misses
+# cost a YouTube search; the IDs are then checked in one videos.list call per 50 IDs.
+# At most MAX_BULK_SEARCHES misses are searched; the rest, and any song whose search failed,
+# come back with "pending": true and empty video IDs so the client can ask for them again later.
+@app.post("/youtube-lessons-videos-bulk")
+async def youtube_lessons_videos_bulk(songs: List[Dict[str, str]]):
+    if not songs:
+        raise HTTPException(status_code=400, detail="At least one song is required.")
+    if len(songs) > MAX_BULK_SONGS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_SONGS} songs can be requested at once.")
+    requested = []
+    for song in songs:
+        song_name = song.get("song_name")
+        artist_name = song.get("artist_name")
+        if not song_name or not artist_name:
+            raise HTTPException(status_code=400, detail="Each song requires a song name and artist name.")
+        requested.append((song_name, artist_name))
+
+    song_key = get_youtube_video_ids.cache_key
+    unique_songs = {}
+    for song_name, artist_name in requested:
+        unique_songs.setdefault(song_key(song_name, artist_name), (song_name, artist_name))
+    lookup_cache = get_youtube_video_ids.cache
+    cached_keys = [key for key in unique_songs if key in lookup_cache]
+    missed_keys = [key for key in unique_songs if key not in lookup_cache]
+    searched_keys = cached_keys + missed_keys[:MAX_BULK_SEARCHES]
+    pending_keys = set(missed_keys[MAX_BULK_SEARCHES:])
+    results = await asyncio.gather(*(
+        get_youtube_video_ids(*unique_songs[key])
+        for key in searched_keys
+    ), return_exceptions=True)
+    video_ids_by_song = {}
+    for key, result in zip(searched_keys, results):
+        if isinstance(result, Exception):
+            # Errors are not cached, so the client can retry this song like any other pending one.
+            logger.warning("Error searching YouTube lesson videos for %s: %s", key, result)
+            pending_keys.add(key)
+            result = []
+        video_ids_by_song[key] = result
+    video_ids_by_song.update((key, []) for key in pending_keys)
+
+    all_video_ids = [video_id for video_ids in video_ids_by_song.values() for video_id in video_ids]
+    try:
+        available_ids = await get_available_video_ids(all_video_ids)
+    except Exception as e:
+        # Cached IDs are still the best answer we have if the availability check fails.
+        logger.warning("Error checking YouTube video availability: %s", e)
+        available_ids = set(all_video_ids)
+
+    return {
+        "results": [
+            {
+                "song_name": song_name,
+                "artist_name": artist_name,
+                "video_ids": [
+                    video_id for video_id in video_ids_by_song[song_key(song_name, artist_name)]
+                    if video_id in available_ids
+                ],
+                "pending": song_key(song_name, artist_name) in pending_keys
+            }
+            for song_name, artist_name in requested
+        ]
+    }
+
 # This function handles the /test-spotify endpoint.
 # It takes a song name and artist name as input, searches for the song on Spotify,
 @app.get("/test-spotify")
 async def test_spotify(song_name: str, artist_name: str):
-    result = search_spotify(song_name, artist_name)
+    result = await search_spotify(song_name, artist_name)
     return {"spotify_result": result}
 
 # This function runs the FastAPI application using Uvicorn.
 # It sets the host and port for the server, allowing it to be accessed from outside the local machine.
+# It runs WEB_CONCURRENCY worker processes (2 by default) with the httptools HTTP parser, and on uvloop
+# where it is installed (it is not available on Windows). Caches and rate limits are kept in memory,
+# so each worker has its own. The Procfile and railway.json start uvicorn directly and do not use this block.
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8080))  # Railway uses 8080 by default
     # Check if the port is set in the environment variables
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        workers=int(os.getenv("WEB_CONCURRENCY", "2")),
+        loop="auto",
+        http="httptools",
+        log_level="info"
+    )